@@ -3,29 +3,115 @@ app.py
 Main entry point. Maps WebSocket JSON -> VMC Protocol.
 """
 import json
-from flask import Flask
+import queue
+import threading
+import time
+from flask import Flask, request
 from flask_sock import Sock
 from vmc_transport import VMCTransport
 import vmc_protocol as p
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 SERIAL_PORT = "/dev/ttyS1"
 BAUDRATE = 57600
+WS_QUEUE_SIZE = 1024 # Events buffered per client before it is dropped
+BATCH_WINDOW = 0.005 # Seconds an NDJSON client's events are gathered per frame
 
 app = Flask(__name__)
 sock = Sock(app)
 vmc = None
-ws_clients = []
+ws_clients = {} # ws -> outbound event queue
+
+# WS "type" -> (Command ID, Encoder or None), resolved once at import
+WS_COMMANDS = {name: (cmd_id, p.ENCODERS.get(name)) for name, cmd_id in p.COMMAND_MAP.items()}
+
+# "0x11"-style label for every possible Command ID (one byte)
+CMD_HEX = tuple(f"0x{i:02X}" for i in range(256))
 
 # --- Callbacks ---
 
+def to_json(msg):
+    """Serialize an event as a WebSocket text frame (orjson when available)"""
+    if orjson is not None:
+        return orjson.dumps(msg).decode()
+    return json.dumps(msg)
+
+def from_json(text):
+    """Parse an incoming WebSocket message (orjson when available)"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
 def broadcast(msg):
-    """Send JSON to all connected Websockets"""
-    json_msg = json.dumps(msg)
-    for ws in ws_clients[:]:
+    """Queue JSON for all connected Websockets, dropping any that fall behind"""
+    json_msg = to_json(msg)
+    for ws, q in list(ws_clients.items()):
         try:
-            ws.send(json_msg)
-        except:
-            ws_clients.remove(ws)
+            q.put_nowait(json_msg)
+        except queue.Full:
+            drop_client(ws)
+
+def reply(ws, msg):
+    """Queue JSON for a single client"""
+    q = ws_clients.get(ws)
+    if q is None: return
+    try:
+        q.put_nowait(to_json(msg))
+    except queue.Full:
+        drop_client(ws)
+
+def drop_client(ws):
+    """Forget a client and wake its writer so it exits"""
+    q = ws_clients.pop(ws, None)
+    if q is None: return
+    try:
+        while True: q.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        q.put_nowait(None)
+    except queue.Full:
+        pass
+
+def gather(q, first):
+    """
+    Join events arriving within BATCH_WINDOW of the first one into a
+    single NDJSON payload. Returns (payload, closed).
+    """
+    msgs = [first]
+    deadline = time.monotonic() + BATCH_WINDOW
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0: break
+        try:
+            msg = q.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if msg is None: return "\n".join(msgs), True
+        msgs.append(msg)
+    return "\n".join(msgs), False
+
+def ws_writer(ws, q, batch=False):
+    """Per-client sender, so one slow socket never stalls the others"""
+    closed = False
+    while not closed:
+        msg = q.get()
+        if msg is None: break
+        if batch:
+            msg, closed = gather(q, msg)
+        try:
+            ws.send(msg)
+        except Exception:
+            break
+    drop_client(ws)
+    try:
+        ws.close() # Let an evicted browser reconnect
+    except Exception:
+        pass
 
 def on_vmc_log(msg):
     print(f"[VMC] {msg}")
@@ -39,27 +125,20 @@ def on_vmc_packet(cmd_id, payload):
     If we know the command, parse it detail.
     If we don't know it, use the generic decoder.
     """
-    cmd_hex = f"0x{cmd_id:02X}"
-    
     # 1. Try to find a specific decoder (e.g., for 0x11 or 0x04)
-    if cmd_id in p.DECODERS:
-        decoded = p.DECODERS[cmd_id](payload)
-        # Add the command ID to the result for clarity
-        decoded["cmd"] = cmd_hex
-        broadcast(decoded)
-        
     # 2. If no specific decoder exists, use the Catch-All
-    else:
-        # Use the generic decoder we just added to vmc_protocol.py
-        generic_data = p.decode_generic(payload)
-        generic_data["cmd"] = cmd_hex
-        broadcast(generic_data)
+    decoder = p.DECODERS.get(cmd_id, p.decode_generic)
+    decoded = decoder(payload)
+
+    # Add the command ID to the result for clarity
+    decoded["cmd"] = CMD_HEX[cmd_id]
+    broadcast(decoded)
+
 # --- WebSocket Handler ---
 
 @sock.route("/ws/vmc")
 def vmc_ws(ws):
     global vmc
-    ws_clients.append(ws)
     
     # Initialize Transport if not already running
     if vmc is None:
@@ -67,25 +146,31 @@ def vmc_ws(ws):
             vmc = VMCTransport(SERIAL_PORT, BAUDRATE, on_vmc_packet, on_vmc_log)
             vmc.start()
         except Exception as e:
-            ws.send(json.dumps({"event": "error", "message": str(e)}))
+            ws.send(to_json({"event": "error", "message": str(e)}))
             return
 
+    # From here on ws_writer is the only thread that sends on this socket
+    # ?batch=ndjson clients get newline-separated events, several per frame
+    batch = request.args.get("batch") == "ndjson"
+    q = ws_clients[ws] = queue.Queue(maxsize=WS_QUEUE_SIZE)
+    threading.Thread(target=ws_writer, args=(ws, q, batch), daemon=True).start()
+
     while True:
         data = ws.receive()
         if not data: break
         
         try:
-            req = json.loads(data)
+            req = from_json(data)
             msg_type = req.get("type")
             
             # 1. Validate Command exists in Protocol
-            if msg_type not in p.COMMAND_MAP:
-                ws.send(json.dumps({"event": "error", "message": f"Unknown type: {msg_type}"}))
+            command = WS_COMMANDS.get(msg_type)
+            if command is None:
+                reply(ws, {"event": "error", "message": f"Unknown type: {msg_type}"})
                 continue
 
             # 2. Get ID and Encoder
-            cmd_id = p.COMMAND_MAP[msg_type]
-            encoder = p.ENCODERS.get(msg_type)
+            cmd_id, encoder = command
             
             # 3. Encode Payload (if encoder exists, else empty bytes)
             payload = encoder(req) if encoder else b""
@@ -94,9 +179,9 @@ def vmc_ws(ws):
             vmc.send_command(cmd_id, payload, f"WS Command: {msg_type}")
             
         except Exception as e:
-            ws.send(json.dumps({"event": "error", "message": f"Processing error: {str(e)}"}))
+            reply(ws, {"event": "error", "message": f"Processing error: {str(e)}"})
 
-    ws_clients.remove(ws)
+    drop_client(ws)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
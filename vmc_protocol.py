@@ -27,6 +27,17 @@ COMMAND_MAP = {
     "deduct":           0x64, # [cite: 260]
 }
 
+# --- Payload Layouts ---
+# Precompiled big-endian layouts shared by encoders and decoders
+_U16 = struct.Struct('>H')              # Selection(2)
+_U32 = struct.Struct('>I')              # Amount(4)
+_SEL_PRICE = struct.Struct('>HI')       # Sel(2)+Price(4)
+_SEL_INV = struct.Struct('>HB')         # Sel(2)+Inv(1)
+_DIRECT_VEND = struct.Struct('>BBHB')   # Drop(1)+Elev(1)+Sel(2)+Cart(1)
+_MODE_AMOUNT = struct.Struct('>BI')     # Mode(1)+Amount(4)
+_SLOT_INFO = struct.Struct('>HIBBHB')   # Sel(2)+Price(4)+Inv(1)+Cap(1)+ID(2)+Stat(1)
+_STATUS_SEL = struct.Struct('>BH')      # Status(1)+Sel(2)
+
 # --- Encoders (PC -> VMC) ---
 # Functions to turn Python variables into bytes for the payload
 
@@ -53,18 +64,15 @@ def decode_generic(payload):
 
 def encode_buy(data):
     # [cite: 187] Selection number (2 byte)
-    return int(data['selection']).to_bytes(2, 'big')
+    return _U16.pack(int(data['selection']))
 
 def encode_set_price(data):
     # [cite: 155] Selection (2 byte) + Price (4 byte)
-    sel = int(data['selection']).to_bytes(2, 'big')
-    price = int(data['price']).to_bytes(4, 'big')
-    return sel + price
+    return _SEL_PRICE.pack(int(data['selection']), int(data['price']))
 
 def encode_direct_vend(data):
     # [cite: 205] Drop(1) + Elev(1) + Sel(2) + Cart(1)
-    return struct.pack(
-        '>BBHB',
+    return _DIRECT_VEND.pack(
         1 if data.get('use_drop', True) else 0,
         1 if data.get('use_elevator', True) else 0,
         int(data['selection']),
@@ -73,27 +81,23 @@ def encode_direct_vend(data):
 
 def encode_deduct(data):
     # [cite: 264] Amount (4 byte)
-    return int(data['amount']).to_bytes(4, 'big')
+    return _U32.pack(int(data['amount']))
 
 def encode_check_selection(data):
     # [cite: 178] Selection number (2 byte)
-    return int(data['selection']).to_bytes(2, 'big')
+    return _U16.pack(int(data['selection']))
 
 def encode_set_inventory(data):
     # [cite: 156] Selection (2 byte) + Inventory (1 byte)
-    sel = int(data['selection']).to_bytes(2, 'big')
-    inv = int(data['inventory']).to_bytes(1, 'big')
-    return sel + inv
+    return _SEL_INV.pack(int(data['selection']), int(data['inventory']))
 
 def encode_select_or_cancel(data):
     # [cite: 201] Selection number (2 byte)
-    return int(data['selection']).to_bytes(2, 'big')
+    return _U16.pack(int(data['selection']))
 
 def encode_add_money(data):
-    # [cite: 266] Amount (4 byte)
-    mode = int(1).to_bytes(1, 'big')
-    amount = int(data['amount']).to_bytes(4, 'big')
-    return mode + amount
+    # [cite: 266] Mode (1 byte) + Amount (4 byte)
+    return _MODE_AMOUNT.pack(1, int(data['amount']))
 
 # Dispatcher for encoders
 ENCODERS = {
@@ -115,7 +119,7 @@ def decode_slot_info(payload):
     # Payload[0] is PackNO, so actual data starts at payload[1]
     if len(payload) < 12: return {"error": "packet too short"}
     
-    unpacked = struct.unpack('>HIBBHB', payload[1:12])
+    unpacked = _SLOT_INFO.unpack_from(payload, 1)
     return {
         "event": "slot_info",
         "pack_no": payload[0],
@@ -131,11 +135,12 @@ def decode_slot_info(payload):
 def decode_vend_status(payload):
     # [cite: 195] PackNo(1)+Status(1)+Sel(2)
     if len(payload) < 4: return {"error": "packet too short"}
+    status_code, selection = _STATUS_SEL.unpack_from(payload, 1)
     return {
         "event": "vend_status",
         "pack_no": payload[0],
-        "status_code": payload[1],
-        "selection": int.from_bytes(payload[2:4], 'big'),
+        "status_code": status_code,
+        "selection": selection,
         "raw_payload": payload.hex()
     }
 
@@ -155,7 +160,7 @@ def decode_selection_status(payload):
     # [cite: 257] Complex packet decoding
     if len(payload) < 4: return {"error": "packet too short"}
     
-    status_code = payload[1]
+    status_code, selection = _STATUS_SEL.unpack_from(payload, 1)
     status_message = {
         0x01: "Normal",
         0x02: "Out of stock",
@@ -172,38 +177,39 @@ def decode_selection_status(payload):
         "pack_no": payload[0],
         "status_code": status_code,
         "status_message": status_message,
-        "selection": int.from_bytes(payload[2:4], 'big'),
+        "selection": selection,
         "raw_payload": payload.hex()
     }
 
 def decode_select_or_cancel(payload):
     # [cite: 201] Selection number (2 byte)
-    if len(payload) < 2: return {"error": "packet too short"}
+    if len(payload) < 3: return {"error": "packet too short"}
     return {
         "event": "select_or_cancel",
         "pack_no": payload[0],
-        "selection": int.from_bytes(payload[1:3], 'big'),
+        "selection": _U16.unpack_from(payload, 1)[0],
         "raw_payload": payload.hex()
     }
 
 def decode_receive_money(payload):
     # [cite: 261] Amount (4 byte)
-    if len(payload) < 5: return {"error": "packet too short"}
+    if len(payload) < 6: return {"error": "packet too short"}
+    mode, amount = _MODE_AMOUNT.unpack_from(payload, 1)
     return {
         "event": "received_money",
         "pack_no": payload[0],
-        "mode": payload[1],
-        "amount": int.from_bytes(payload[2:6], 'big'),
+        "mode": mode,
+        "amount": amount,
         "raw_payload": payload.hex()
     }
 
 def decode_current_amount(payload):
     # [cite: 263] Amount (4 byte)
-    if len(payload) < 4: return {"error": "packet too short"}
+    if len(payload) < 5: return {"error": "packet too short"}
     return {
         "event": "current_amount",
         "pack_no": payload[0],
-        "amount": int.from_bytes(payload[1:5], 'big'),
+        "amount": _U32.unpack_from(payload, 1)[0],
         "raw_payload": payload.hex()
     }
 
@@ -218,17 +224,37 @@ DECODERS = {
     0x23: decode_current_amount,
 }
 
+def checksum(data):
+    """XOR of every byte in data [cite: 91]"""
+    n = len(data)
+    if n < 96: # Below this the loop beats the fold
+        xor_val = 0
+        for b in data:
+            xor_val ^= b
+        return xor_val
+
+    # Long frames: load as one integer and fold it in halves down to a byte,
+    # O(log n) big-int operations instead of n Python-level XORs
+    x = int.from_bytes(data, 'little')
+    while n > 1:
+        n = (n + 1) // 2
+        x = (x ^ (x >> (n * 8))) & ((1 << (n * 8)) - 1)
+    return x
+
+def _frame(cmd_id, text):
+    """STX + CMD + LEN + Text + XOR [cite: 86]"""
+    header = bytes([STX1, STX2, cmd_id, len(text)])
+
+    # [cite: 91] Checksum calculation
+    xor_val = checksum(header + text)
+
+    return header + text + bytes([xor_val])
+
 def build_frame(cmd_id, comm_no, payload_bytes):
     """Constructs the full packet with checksum [cite: 86]"""
     # [cite: 90] PackNO is the first byte of text
-    full_payload = bytes([comm_no]) + payload_bytes
-    length = len(full_payload)
-    
-    header = bytes([STX1, STX2, cmd_id, length])
-    
-    # [cite: 91] Checksum calculation
-    xor_val = 0
-    for b in header + full_payload:
-        xor_val ^= b
-        
-    return header + full_payload + bytes([xor_val])
\ No newline at end of file
+    return _frame(cmd_id, bytes([comm_no]) + payload_bytes)
+
+# ACK carries no text, so the frame never changes (FA FB 42 00 43)
+ACK_FRAME = _frame(CMD_ACK, b"")
+assert ACK_FRAME == b"\xFA\xFB\x42\x00\x43", "ACK frame no longer matches the protocol"
@@ -2,137 +2,229 @@
 vmc_transport.py
 Handles Serial I/O, POLL/ACK handshake, and threading.
 """
+import logging
+import queue
 import serial
 import threading
 import time
+from dataclasses import dataclass
 import vmc_protocol as p
 
+# Start of Frame marker [cite: 87]
+_STX = bytes([p.STX1, p.STX2])
+
+@dataclass(slots=True)
+class PendingCommand:
+    """Outgoing command waiting for its POLL slot"""
+    frame: bytes # Built once, resent as-is on every retry
+    desc: str
+    retries: int = 0
+
 class VMCTransport:
-    def __init__(self, port, baudrate, on_packet_received, on_log):
+    __slots__ = ("ser", "on_packet", "on_log", "log_level", "events", "running",
+                 "buffer", "read_pos", "tx",
+                 "busy", "commands", "state", "next_comm_no", "pending_cmd")
+
+    def __init__(self, port, baudrate, on_packet_received, on_log, log_level=logging.DEBUG):
         self.ser = serial.Serial(port, baudrate, timeout=0.05)
+        if hasattr(self.ser, "set_buffer_size"): # Windows backend only
+            self.ser.set_buffer_size(rx_size=16384, tx_size=4096)
         self.on_packet = on_packet_received # Callback for valid data
         self.on_log = on_log                # Callback for logging
+        self.log_level = log_level          # Messages below this level are never formatted
+        self.events = queue.SimpleQueue()   # (callback, *args), run by _dispatch
         self.running = True
+
+        # Receive buffer; bytes before read_pos are already parsed
+        self.buffer = bytearray()
+        self.read_pos = 0
+
+        # Frames to send, written in one go after each parse pass
+        self.tx = bytearray()
         
-        # State
-        self.lock = threading.Lock()
+        # Held from send_command until _loop returns to idle: one command at a time
+        self.busy = threading.Lock()
+
+        # Commands from other threads, installed by _loop
+        self.commands = queue.SimpleQueue()
+
+        # State (owned by the _loop thread, no lock needed)
         self.state = "idle" # idle, waiting_ack, waiting_data
         self.next_comm_no = 1
         
         # Current outgoing command
-        self.pending_cmd = None # {cmd_id, payload, retries, desc}
+        self.pending_cmd = None # PendingCommand
 
     def start(self):
+        threading.Thread(target=self._dispatch, daemon=True).start()
         t = threading.Thread(target=self._loop, daemon=True)
         t.start()
 
     def stop(self):
         self.running = False
-        if self.ser.is_open: self.ser.close()
+        self.events.put(None)
+        if self.ser.is_open:
+            self.ser.cancel_read() # Wake _loop out of its blocking read
+            self.ser.close()
 
     def send_command(self, cmd_id, payload_bytes, description):
         """Queue a command to be sent on next POLL"""
-        with self.lock:
-            # Simple flow: only one command at a time
-            if self.state != "idle": 
-                raise RuntimeError("Busy: Command in progress")
-            
+        # Simple flow: only one command at a time
+        if not self.busy.acquire(blocking=False):
+            raise RuntimeError("Busy: Command in progress")
+        self.commands.put((cmd_id, payload_bytes, description))
+
+    def _install_commands(self):
+        """Move commands queued by send_command into the state machine (runs on _loop)"""
+        while True:
+            try:
+                cmd_id, payload_bytes, description = self.commands.get_nowait()
+            except queue.Empty:
+                return
+
             comm = self.next_comm_no
             self.next_comm_no = (self.next_comm_no + 1) if self.next_comm_no < 255 else 1
             
-            self.pending_cmd = {
-                "cmd_id": cmd_id,
-                "comm_no": comm,
-                "payload": payload_bytes,
-                "retries": 0,
-                "desc": description
-            }
+            frame = p.build_frame(cmd_id, comm, payload_bytes)
+            self.pending_cmd = PendingCommand(frame, description)
             self.state = "waiting_ack"
-            self.on_log(f"Queued: {description} (Comm: {comm})")
+            self._log(logging.DEBUG, "Queued: %s (Comm: %d)", description, comm)
 
     def _loop(self):
-        buffer = bytearray()
+        ser = self.ser # Bound once for the life of the loop
+        read = ser.read
         while self.running:
             try:
-                if self.ser.in_waiting:
-                    buffer.extend(self.ser.read(self.ser.in_waiting))
-                    self._process_buffer(buffer)
-                time.sleep(0.01)
+                # Block until the frame in progress is complete (or the port timeout),
+                # then drain whatever else arrived. in_waiting is a FIONREAD ioctl,
+                # queried once per wake.
+                chunk = read(self._missing())
+                if chunk:
+                    n = ser.in_waiting
+                    if n: chunk += read(n)
+                self._install_commands() # Before parsing, so a POLL in this chunk can carry it
+                if chunk:
+                    self.buffer.extend(chunk)
+                    self._process_buffer()
+                    self._flush()
             except Exception as e:
-                self.on_log(f"Serial Error: {e}")
+                if not self.running: break # Port closed by stop()
+                self._log(logging.ERROR, "Serial Error: %s", e)
                 time.sleep(1)
 
-    def _process_buffer(self, buffer):
-        while len(buffer) >= 5: # Min packet size
+    def _missing(self):
+        """Bytes still needed to complete the frame at read_pos, per its LEN byte"""
+        buffer = self.buffer
+        pos = self.read_pos
+        have = len(buffer) - pos
+        if have >= 4 and buffer[pos] == p.STX1 and buffer[pos + 1] == p.STX2:
+            return max(1, 5 + buffer[pos + 3] - have) # STX(2)+CMD(1)+LEN(1)+XOR(1) + payload
+        return max(1, 5 - have) # Min packet size: a whole POLL/ACK in one read
+
+    def _process_buffer(self):
+        buffer = self.buffer
+        pos = self.read_pos
+        while len(buffer) - pos >= 5: # Min packet size
             # [cite_start]Find Start of Frame [cite: 87]
-            if buffer[0] != p.STX1 or buffer[1] != p.STX2:
-                buffer.pop(0)
-                continue
+            start = buffer.find(_STX, pos)
+            if start < 0:
+                # Drop the noise, but keep a trailing STX1 that may pair with the next read
+                pos = len(buffer) - 1 if buffer[-1] == p.STX1 else len(buffer)
+                break
+            pos = start
+            if len(buffer) - pos < 5:
+                break # Wait for more data
                 
-            cmd = buffer[2]
-            length = buffer[3]
+            cmd = buffer[pos + 2]
+            length = buffer[pos + 3]
             frame_len = 5 + length # STX(2)+CMD(1)+LEN(1)+XOR(1) + payload
             
-            if len(buffer) < frame_len:
+            if len(buffer) - pos < frame_len:
                 break # Wait for more data
 
-            frame = buffer[:frame_len]
-            payload = frame[4:-1]
-            received_xor = frame[-1]
-            del buffer[:frame_len]
+            end = pos + frame_len
+            received_xor = buffer[end - 1]
 
             # [cite_start]Verify Checksum [cite: 91]
-            calc_xor = 0
-            for b in frame[:-1]: calc_xor ^= b
-            
-            if calc_xor == received_xor:
+            # Read the frame through a view; only a valid payload is copied out.
+            # The view is released before the buffer is resized again.
+            with memoryview(buffer) as mv:
+                calc_xor = p.checksum(mv[pos:end - 1])
+                payload = bytes(mv[pos + 4:end - 1]) if calc_xor == received_xor else None
+            pos = end
+
+            if payload is not None:
                 self._handle_valid_packet(cmd, payload)
             else:
-                self.on_log(f"Checksum Error on cmd {cmd:02X}")
+                self._log(logging.WARNING, "Checksum Error on cmd %02X", cmd)
+
+        # Compact only once the parsed prefix outweighs what is left
+        self.read_pos = pos
+        if pos > len(buffer) // 2:
+            del buffer[:pos]
+            self.read_pos = 0
 
     def _handle_valid_packet(self, cmd, payload):
         # [cite_start]1. Handle POLL (Heartbeat) [cite: 70]
         if cmd == p.CMD_POLL:
-            with self.lock:
-                if self.state == "waiting_ack" and self.pending_cmd:
-                    # [cite_start]We have a command waiting, send it now [cite: 74]
-                    self._transmit_pending()
-                elif self.state == "waiting_data" and self.pending_cmd:
-                    # We were waiting for data, but got POLL. Means transaction finished.
-                    self.on_log(f"Finished: {self.pending_cmd['desc']}")
-                    self.state = "idle"
-                    self.pending_cmd = None
-                    self._send_ack()
-                else:
-                    # [cite_start]Nothing to do, just ACK [cite: 75]
-                    self._send_ack()
+            if self.state == "waiting_ack" and self.pending_cmd:
+                # [cite_start]We have a command waiting, send it now [cite: 74]
+                self._transmit_pending()
+            elif self.state == "waiting_data" and self.pending_cmd:
+                # We were waiting for data, but got POLL. Means transaction finished.
+                self._log(logging.INFO, "Finished: %s", self.pending_cmd.desc)
+                self._set_idle()
+                self.tx += p.ACK_FRAME
+            else:
+                # [cite_start]Nothing to do, just ACK [cite: 75]
+                self.tx += p.ACK_FRAME
         
         # [cite_start]2. Handle ACK (Response to our command) [cite: 76]
         elif cmd == p.CMD_ACK:
-            with self.lock:
-                if self.state == "waiting_ack":
-                    self.state = "waiting_data" # Now wait for the data response
-                    self.on_log("ACK received from VMC")
+            if self.state == "waiting_ack":
+                self.state = "waiting_data" # Now wait for the data response
+                self._log(logging.DEBUG, "ACK received from VMC")
 
         # 3. Handle DATA (Info from VMC)
         else:
-            self._send_ack() # Always ACK data
-            self.on_packet(cmd, payload)
+            self.tx += p.ACK_FRAME # Always ACK data
+            self.events.put((self.on_packet, cmd, payload))
 
     def _transmit_pending(self):
         c = self.pending_cmd
-        if c['retries'] >= 5:
-            self.on_log(f"Timeout: {c['desc']}")
-            self.state = "idle"
-            self.pending_cmd = None
-            self._send_ack()
+        if c.retries >= 5:
+            self._log(logging.WARNING, "Timeout: %s", c.desc)
+            self._set_idle()
+            self.tx += p.ACK_FRAME
             return
 
-        packet = p.build_frame(c['cmd_id'], c['comm_no'], c['payload'])
-        self.ser.write(packet)
-        c['retries'] += 1
+        self.tx += c.frame
+        c.retries += 1
+
+    def _set_idle(self):
+        self.state = "idle"
+        self.pending_cmd = None
+        self.busy.release() # Taken by send_command
 
-    def _send_ack(self):
-        # ACK Packet
-        ack = bytes([p.STX1, p.STX2, p.CMD_ACK, 0x00, 0x43]) # 0x43 is XOR of FA+FB+42+00
-        self.ser.write(ack)
\ No newline at end of file
+    def _log(self, level, fmt, *args):
+        if level >= self.log_level:
+            self.events.put((self.on_log, fmt % args if args else fmt))
+
+    def _dispatch(self):
+        """Runs the callbacks, so a slow consumer never delays serial reads"""
+        while True:
+            event = self.events.get()
+            if event is None: break # stop()
+            callback, *args = event
+            try:
+                callback(*args)
+            except Exception as e:
+                if callback is not self.on_log:
+                    self._log(logging.ERROR, "Callback Error: %s", e)
+
+    def _flush(self):
+        if self.tx:
+            try:
+                self.ser.write(self.tx)
+            finally:
+                self.tx.clear() # A failed write must not replay stale replies later
\ No newline at end of file